@@ -1,7 +1,8 @@
-from flask import Flask, request, jsonify
+from quart import Quart, request, jsonify
 from src.vision_parse import VisionParser
 import os
 import logging
+import orjson
 
 try:
     from dotenv import load_dotenv
@@ -12,7 +13,9 @@ except ImportError:
 load_dotenv()
 
 
-app = Flask(__name__)
+app = Quart(__name__)
+# Reject oversized uploads with 413 before the request body is read
+app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
 
 # Initialize parser (from gemini_demo.ipynb, adapt as needed)
 parser = VisionParser(
@@ -29,36 +32,38 @@ parser = VisionParser(
 
 logging.basicConfig(level=logging.DEBUG)
 
+
+@app.before_serving
+async def warmup_parser():
+    # Open the Gemini connection on the serving loop before the first upload
+    await parser.warmup()
+
+
 @app.route('/', methods=['POST'])
-def process_file():
+async def process_file():
     try:
-        if 'file' not in request.files:
+        files = await request.files
+        if 'file' not in files:
             logging.error("No file part")
             return jsonify({'error': 'No file part'}), 400
-        file = request.files['file']
+        file = files['file']
         if file.filename == '':
             logging.error("No selected file")
             return jsonify({'error': 'No selected file'}), 400
 
-        # Save the uploaded file temporarily
-        temp_path = 'temp.' + file.filename.split('.')[-1]
-        file.save(temp_path)
-        logging.info(f"File saved to {temp_path}")
-        logging.info(f"File size: {os.path.getsize(temp_path)} bytes")
+        # Validate the file type before reading the upload into memory
+        ext = os.path.splitext(file.filename)[1].lower()
+        if ext not in {'.pdf', '.png', '.jpg', '.jpeg'}:
+            logging.error(f"Unsupported file type: {file.filename}")
+            return jsonify({'error': 'Unsupported file type'}), 400
+
+        # Parse the upload in memory without a temporary file
+        data = file.read()
+        logging.info(f"File size: {len(data)} bytes")
         logging.info(f"Content type: {request.content_type}")
         logging.info(f"Content length: {request.content_length}")
-        logging.debug(f"Request data: {request.data}")
-
-        if temp_path.lower().endswith(('.pdf')):
-            markdown_pages = parser.convert_file(temp_path)
-        elif temp_path.lower().endswith(('.jpg', '.jpeg', '.png')):
-            markdown_pages = parser.convert_image(temp_path)
-        else:
-            logging.error(f"Unsupported file type: {temp_path}")
-            return jsonify({'error': 'Unsupported file type'}), 400
 
-        os.remove(temp_path)
-        logging.info(f"File removed: {temp_path}")
+        markdown_pages = await parser.aconvert_stream(data, ext)
 
         # Format output as JSON
         # Validate and adjust table structure in markdown pages
@@ -73,11 +78,12 @@ def process_file():
 
             output.append({"page": i + 1, "content": page_content})
 
-        return jsonify(output)
+        return app.response_class(orjson.dumps(output), mimetype='application/json')
 
     except Exception as e:
         logging.exception(f"An error occurred: {e}")
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    # Development server only; deploy with: hypercorn -w 4 -b 0.0.0.0:5000 main:app
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,8 +1,9 @@
-from typing import Literal, Dict, Any, Union
-from pydantic import BaseModel
+from typing import Literal, Dict, Any, Union, List, Tuple
+from pydantic import BaseModel, TypeAdapter
 from jinja2 import Template
 import re
 import fitz
+import hashlib
 import os
 from tqdm import tqdm
 from .utils import ImageData
@@ -12,6 +13,21 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+_MD_FENCE_RE = re.compile(r"```(?:markdown)?\n(.*?)\n```", re.DOTALL)
+
+
+def _strip_markdown_fence(text: str) -> str:
+    """Remove markdown code fences, slicing directly when the whole text is fenced."""
+    if text.endswith("\n```"):
+        for opening in ("```markdown\n", "```\n"):
+            if text.startswith(opening) and len(text) >= len(opening) + 4:
+                inner = text[len(opening) : -len("\n```")]
+                # Nested fences need the regex to pair them up correctly
+                if "```" not in inner:
+                    return inner
+                break
+    return _MD_FENCE_RE.sub(r"\1", text)
+
 
 class ImageDescription(BaseModel):
     """Model Schema for image description."""
@@ -24,6 +40,13 @@ class ImageDescription(BaseModel):
     confidence_score_text: float
 
 
+class PageResult(BaseModel):
+    """Model Schema for the fused image description and markdown extraction."""
+
+    description: ImageDescription
+    markdown: str
+
+
 class UnsupportedModelError(BaseException):
     """Custom exception for unsupported model names"""
 
@@ -47,6 +70,9 @@ class LLM:
         _md_prompt_template = Template(
             files("vision_parse").joinpath("markdown_prompt.j2").read_text()
         )
+        _batch_prompt_template = Template(
+            files("vision_parse").joinpath("batch_analysis.j2").read_text()
+        )
     except Exception as e:
         raise FileNotFoundError(f"Failed to load prompt files: {str(e)}")
 
@@ -63,6 +89,11 @@ class LLM:
         enable_concurrency: bool,
         device: Literal["cuda", "mps", None],
         num_workers: int,
+        image_format: Literal["png", "jpeg"] = "png",
+        cache_dir: Union[str, None] = None,
+        cache_nondeterministic: bool = False,
+        phash_threshold: Union[int, None] = None,
+        request_timeout: float = 60.0,
         **kwargs: Any,
     ):
         self.model_name = model_name
@@ -77,9 +108,33 @@ class LLM:
         self.enable_concurrency = enable_concurrency
         self.device = device
         self.num_workers = num_workers
+        self.image_mime_type = f"image/{image_format}"
+        self.cache_dir = cache_dir
+        self.cache_nondeterministic = cache_nondeterministic
+        self.phash_threshold = phash_threshold
+        self.request_timeout = request_timeout
+
+        # Prompts only depend on constructor arguments, so render them once
+        self._default_md_prompt = self._md_prompt_template.render(
+            extracted_text="",
+            tables_detected="Yes",
+            latex_equations_detected="No",
+            confidence_score_text=0.0,
+            custom_prompt=self.custom_prompt,
+        )
+        self._analysis_prompt = self._image_analysis_prompt.render(
+            markdown_instructions=self._md_prompt_template.render(
+                extracted_text="",
+                tables_detected="Yes",
+                latex_equations_detected="Yes",
+                confidence_score_text=0.0,
+                custom_prompt=self.custom_prompt,
+            )
+        )
 
         self.provider = self._get_provider_name(model_name)
         self._init_llm()
+        self._init_cache()
 
     def _init_llm(self) -> None:
         """Initialize the LLM client."""
@@ -96,12 +151,53 @@ class LLM:
             )
 
         try:
-            genai.configure(api_key=self.api_key)
+            # Use the asyncio gRPC transport so one channel is reused across pages
+            genai.configure(
+                api_key=self.api_key,
+                transport="grpc_asyncio",
+                client_options={"api_endpoint": "generativelanguage.googleapis.com"},
+            )
             self.client = genai.GenerativeModel(model_name=self.model_name)
-            self.generation_config = genai.GenerationConfig
+            # Build generation configs once instead of on every page request
+            self._structured_config = genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=PageResult,
+                temperature=0.0,
+                top_p=0.4,
+                **self.kwargs,
+            )
+            self._batch_config = genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=list[PageResult],
+                temperature=0.0,
+                top_p=0.4,
+                **self.kwargs,
+            )
+            self._markdown_config = genai.GenerationConfig(
+                temperature=self.temperature,
+                top_p=self.top_p,
+                **self.kwargs,
+            )
         except Exception as e:
             raise LLMError(f"Unable to initialize Gemini client: {str(e)}")
 
+    def _init_cache(self) -> None:
+        """Initialize the on-disk response cache and the perceptual-hash index."""
+        self._cache = None
+        self._phash_entries: List[Tuple[int, str]] = []
+
+        if self.cache_dir is None:
+            return
+
+        try:
+            import diskcache
+        except ImportError:
+            raise ImportError(
+                "diskcache is not installed. Please install it using pip install 'vision-parse[cache]'."
+            )
+
+        self._cache = diskcache.Cache(self.cache_dir)
+
     def _get_provider_name(self, model_name: str) -> str:
         """Get the provider name for a given model name."""
         try:
@@ -116,25 +212,57 @@ class LLM:
                 f"Supported models are: {supported_models}"
             )
 
+    def _cache_key(self, image_bytes: bytes, prompt: str, structured: bool) -> bytes:
+        """Build the exact-match cache key for an image, prompt and output mode."""
+        return (
+            hashlib.sha256(image_bytes).digest()
+            + hashlib.sha256(f"{self.model_name}\n{prompt}".encode()).digest()
+            + bytes([structured])
+        )
+
     async def _get_response(
-        self, base64_encoded: str, prompt: str, structured: bool = False
+        self, image_bytes: bytes, prompt: str, structured: bool = False
     ):
-        return await self._gemini(base64_encoded, prompt, structured)
+        # Structured calls run at temperature 0.0 and are always safe to reuse
+        cacheable = self._cache is not None and (
+            structured or self.temperature == 0 or self.cache_nondeterministic
+        )
+        if not cacheable:
+            return await self._gemini(image_bytes, prompt, structured)
+
+        key = self._cache_key(image_bytes, prompt, structured)
+        response = self._cache.get(key)
+        if response is None:
+            response = await self._gemini(image_bytes, prompt, structured)
+            self._cache.set(key, response)
+        return response
+
+    def _find_similar_page(self, page_hash: int) -> Union[str, None]:
+        """Return markdown of a previously seen page within phash_threshold bits."""
+        for known_hash, markdown_content in self._phash_entries:
+            if bin(page_hash ^ known_hash).count("1") <= self.phash_threshold:
+                return markdown_content
+        return None
 
     async def generate_markdown(
-        self, base64_encoded: str, pix: fitz.Pixmap, page_number: int
+        self, image_bytes: bytes, page_number: int, page_hash: Union[int, None] = None
     ) -> Any:
-        """Generate markdown formatted text from a base64-encoded image using appropriate model provider."""
+        """Generate markdown formatted text from an encoded page image using appropriate model provider."""
+        if page_hash is not None:
+            similar_markdown = self._find_similar_page(page_hash)
+            if similar_markdown is not None:
+                return similar_markdown
+
         extracted_images = []
         if self.detailed_extraction:
             try:
+                # Describe the page and render its markdown in a single call
                 response = await self._get_response(
-                    base64_encoded,
-                    self._image_analysis_prompt.render(),
-                    structured=True,
+                    image_bytes, self._analysis_prompt, structured=True
                 )
 
-                json_response = ImageDescription.model_validate_json(response)
+                page_result = PageResult.model_validate_json(response)
+                json_response = page_result.description
 
                 if json_response.text_detected.strip() == "No":
                     return ""
@@ -144,16 +272,10 @@ class LLM:
                     and self.image_mode is not None
                 ):
                     extracted_images = ImageData.extract_images(
-                        pix, self.image_mode, page_number
+                        image_bytes, self.image_mode, page_number
                     )
 
-                prompt = self._md_prompt_template.render(
-                    extracted_text=json_response.extracted_text,
-                    tables_detected=json_response.tables_detected,
-                    latex_equations_detected=json_response.latex_equations_detected,
-                    confidence_score_text=float(json_response.confidence_score_text),
-                    custom_prompt=self.custom_prompt,
-                )
+                markdown_content = page_result.markdown
 
             except Exception:
                 logger.warning(
@@ -162,67 +284,133 @@ class LLM:
                 self.detailed_extraction = False
 
         if not self.detailed_extraction:
-            prompt = self._md_prompt_template.render(
-                extracted_text="",
-                tables_detected="Yes",
-                latex_equations_detected="No",
-                confidence_score_text=0.0,
-                custom_prompt=self.custom_prompt,
+            markdown_content = await self._get_response(
+                image_bytes, self._default_md_prompt, structured=False
             )
 
-        markdown_content = await self._get_response(
-            base64_encoded, prompt, structured=False
-        )
+        markdown_content = self._append_images(markdown_content, extracted_images)
 
-        if extracted_images:
-            if self.image_mode == "url":
-                for image_data in extracted_images:
-                    markdown_content += (
-                        f"\n\n![{image_data.image_url}]({image_data.image_url})"
-                    )
-            elif self.image_mode == "base64":
-                for image_data in extracted_images:
-                    markdown_content += (
-                        f"\n\n![{image_data.image_url}]({image_data.base64_encoded})"
-                    )
+        if page_hash is not None:
+            self._phash_entries.append((page_hash, markdown_content))
 
         return markdown_content
 
+    async def warmup(self) -> None:
+        """Open the Gemini connection before the first page is processed."""
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 1, 1), False)
+        try:
+            await self._gemini(pix.tobytes(self.image_mime_type.split("/")[1]), "ping")
+        except LLMError as e:
+            logger.warning(f"Gemini warmup request failed: {str(e)}")
+
+    def _append_images(
+        self, markdown_content: str, extracted_images: List[ImageData]
+    ) -> str:
+        """Append extracted image references to the page markdown."""
+        if self.image_mode == "url":
+            for image_data in extracted_images:
+                markdown_content += (
+                    f"\n\n![{image_data.image_url}]({image_data.image_url})"
+                )
+        elif self.image_mode == "base64":
+            for image_data in extracted_images:
+                markdown_content += (
+                    f"\n\n![{image_data.image_url}]({image_data.base64_encoded})"
+                )
+        return markdown_content
+
+    async def generate_markdown_batch(
+        self,
+        images: List[bytes],
+        page_numbers: List[int],
+    ) -> List[str]:
+        """Generate markdown for several page images with a single model request."""
+        try:
+            response = await self._gemini_batch(
+                images,
+                self._batch_prompt_template.render(
+                    page_count=len(images),
+                    page_instructions=self._analysis_prompt,
+                ),
+            )
+            page_results = TypeAdapter(List[PageResult]).validate_json(response)
+            if len(page_results) != len(images):
+                raise LLMError(
+                    f"Expected {len(images)} pages in batch response, "
+                    f"got {len(page_results)}"
+                )
+        except (Exception, LLMError):
+            logger.warning(
+                "Batch extraction failed. Falling back to per-page extraction."
+            )
+            return [
+                await self.generate_markdown(image_bytes, page_number)
+                for image_bytes, page_number in zip(images, page_numbers)
+            ]
+
+        markdown_pages = []
+        for page_result, image_bytes, page_number in zip(
+            page_results, images, page_numbers
+        ):
+            json_response = page_result.description
+            if json_response.text_detected.strip() == "No":
+                markdown_pages.append("")
+                continue
+
+            extracted_images = []
+            if (
+                json_response.images_detected.strip() == "Yes"
+                and self.image_mode is not None
+            ):
+                extracted_images = ImageData.extract_images(
+                    image_bytes, self.image_mode, page_number
+                )
+            markdown_pages.append(
+                self._append_images(page_result.markdown, extracted_images)
+            )
+
+        return markdown_pages
+
     @retry(
         reraise=True,
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=4, max=10),
     )
     async def _gemini(
-        self, base64_encoded: str, prompt: str, structured: bool = False
+        self, image_bytes: bytes, prompt: str, structured: bool = False
     ) -> Any:
-        """Process base64-encoded image through Gemini vision models."""
+        """Process encoded page image through Gemini vision models."""
         try:
-            if self.enable_concurrency:
-                response = await self.client.generate_content_async(
-                    [{"mime_type": "image/png", "data": base64_encoded}, prompt],
-                    generation_config=self.generation_config(
-                        response_mime_type="application/json" if structured else None,
-                        response_schema=ImageDescription if structured else None,
-                        temperature=0.0 if structured else self.temperature,
-                        top_p=0.4 if structured else self.top_p,
-                        **self.kwargs,
-                    ),
-                )
-            else:
-                response = self.client.generate_content(
-                    [{"mime_type": "image/png", "data": base64_encoded}, prompt],
-                    generation_config=self.generation_config(
-                        response_mime_type="application/json" if structured else None,
-                        response_schema=ImageDescription if structured else None,
-                        temperature=0.0 if structured else self.temperature,
-                        top_p=0.4 if structured else self.top_p,
-                        **self.kwargs,
-                    ),
-                )
-
-            return re.sub(
-                r"```(?:markdown)?\n(.*?)\n```", r"\1", response.text, flags=re.DOTALL
+            response = await self.client.generate_content_async(
+                [{"mime_type": self.image_mime_type, "data": image_bytes}, prompt],
+                generation_config=(
+                    self._structured_config if structured else self._markdown_config
+                ),
+                request_options={"timeout": self.request_timeout},
             )
+
+            return _strip_markdown_fence(response.text)
         except Exception as e:
             raise LLMError(f"Gemini Model processing failed: {str(e)}")
+
+    @retry(
+        reraise=True,
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+    )
+    async def _gemini_batch(self, images: List[bytes], prompt: str) -> Any:
+        """Process several encoded page images through Gemini in one request."""
+        try:
+            response = await self.client.generate_content_async(
+                [
+                    {"mime_type": self.image_mime_type, "data": image_bytes}
+                    for image_bytes in images
+                ]
+                + [prompt],
+                generation_config=self._batch_config,
+                request_options={"timeout": self.request_timeout},
+            )
+
+            return response.text
+        except Exception as e:
+            raise LLMError(f"Gemini Model batch processing failed: {str(e)}")
@@ -1,18 +1,16 @@
 import fitz  # PyMuPDF library for PDF processing
 from pathlib import Path
-from typing import Optional, List, Dict, Union, Literal, Any
-from tqdm import tqdm
-import base64
+from typing import Optional, List, Dict, Union, Literal, Any, Tuple
+from tqdm.asyncio import tqdm
 from pydantic import BaseModel
 import asyncio
-from .utils import get_device_config
+from .utils import get_device_config, get_perceptual_hash, get_pixel_variance
 from .llm import LLM
-import nest_asyncio
 import logging
+import threading
 import warnings
 
 logger = logging.getLogger(__name__)
-nest_asyncio.apply()
 
 
 class PDFPageConfig(BaseModel):
@@ -22,6 +20,10 @@ class PDFPageConfig(BaseModel):
     color_space: str = "RGB"  # Color mode for image output
     include_annotations: bool = True  # Include PDF annotations in conversion
     preserve_transparency: bool = False  # Control alpha channel in output
+    render_scale: float = 1.0  # Supersampling factor applied on top of dpi
+    image_format: Literal["png", "jpeg"] = "png"  # Encoding sent to the LLM
+    jpeg_quality: int = 85  # JPEG quality (1-100) when image_format is "jpeg"
+    blank_page_threshold: Optional[float] = None  # Skip LLM below this pixel variance
 
 
 class UnsupportedFileError(BaseException):
@@ -37,7 +39,7 @@ class VisionParserError(BaseException):
 
 
 class VisionParser:
-    """Convert PDF pages to base64-encoded images and then extract text from the images in markdown format."""
+    """Convert PDF pages to images and then extract text from the images in markdown format."""
 
     def __init__(
         self,
@@ -51,13 +53,19 @@ class VisionParser:
         custom_prompt: Optional[str] = None,
         detailed_extraction: bool = False,
         enable_concurrency: bool = False,
+        cache_dir: Optional[str] = None,
+        cache_nondeterministic: bool = False,
+        phash_threshold: Optional[int] = None,
+        batch_size: int = 1,
+        request_timeout: float = 60.0,
         **kwargs: Any,
     ):
         """Initialize parser with PDFPageConfig and LLM configuration."""
         self.page_config = page_config or PDFPageConfig()
         self.device, self.num_workers = get_device_config()
         self.enable_concurrency = enable_concurrency
-
+        self.batch_size = max(1, batch_size)
+        self._render_lock = threading.Lock()
 
         self.llm = LLM(
             model_name=model_name,
@@ -71,26 +79,45 @@ class VisionParser:
             enable_concurrency=enable_concurrency,
             device=self.device,
             num_workers=self.num_workers,
+            image_format=self.page_config.image_format,
+            cache_dir=cache_dir,
+            cache_nondeterministic=cache_nondeterministic,
+            phash_threshold=phash_threshold,
+            request_timeout=request_timeout,
             **kwargs,
         )
 
-    def _calculate_matrix(self, page: fitz.Page) -> fitz.Matrix:
+    async def warmup(self) -> None:
+        """Send a tiny request so the first document does not pay connection setup.
+
+        Call this from the event loop that will process documents, e.g. a server
+        startup hook, since the async gRPC channel is bound to that loop.
+        """
+        await self.llm.warmup()
+
+    def _calculate_matrix(self, rotation: int) -> fitz.Matrix:
         """Calculate transformation matrix for page conversion."""
         # Calculate zoom factor based on target DPI
-        zoom = self.page_config.dpi / 72
-        matrix = fitz.Matrix(zoom * 2, zoom * 2)
+        zoom = self.page_config.dpi / 72 * self.page_config.render_scale
+        matrix = fitz.Matrix(zoom, zoom)
 
         # Handle page rotation if present
-        if page.rotation != 0:
-            matrix.prerotate(page.rotation)
+        if rotation != 0:
+            matrix.prerotate(rotation)
 
         return matrix
 
-    async def _convert_page(self, page: fitz.Page, page_number: int) -> str:
-        """Convert a single PDF page into base64-encoded PNG and extract markdown formatted text."""
-        try:
-            matrix = self._calculate_matrix(page)
+    def _render_page(
+        self, page: fitz.Page, matrix: fitz.Matrix
+    ) -> Tuple[Optional[bytes], Optional[int]]:
+        """Rasterize and encode a PDF page; runs in a worker thread.
 
+        Returns the encoded image and its perceptual hash (when the LLM uses one).
+        The pixmap is released here, before any LLM request is awaited, and the
+        image bytes are None for pages detected as blank.
+        """
+        # MuPDF is not thread-safe, so only one page is rendered at a time
+        with self._render_lock:
             # Create high-quality image from PDF page
             pix = page.get_pixmap(
                 matrix=matrix,
@@ -99,50 +126,152 @@ class VisionParser:
                 annots=self.page_config.include_annotations,
             )
 
-            # Convert image to base64 for LLM processing
-            base64_encoded = base64.b64encode(pix.tobytes("png")).decode("utf-8")
-            
-            # Add metadata about table structure
-            metadata = {
-                "rows": detected_row_count,  # Replace with the actual detected row count
-                "columns": detected_column_count,  # Replace with the actual detected column count
-            }
-
-            # Pass metadata as part of the custom prompt
-            custom_prompt = f"""
-            - The table in the image contains {metadata['rows']} rows and {metadata['columns']} columns. Align the Markdown output to match this structure.
-            """
+            # Blank pages never need the LLM, so skip encoding them as well
+            if (
+                self.page_config.blank_page_threshold is not None
+                and get_pixel_variance(pix) < self.page_config.blank_page_threshold
+            ):
+                return None, None
+
+            # Raw bytes are sent as-is; the Gemini SDK handles transport encoding
+            if self.page_config.image_format == "jpeg":
+                image_bytes = pix.tobytes(
+                    output="jpeg", jpg_quality=self.page_config.jpeg_quality
+                )
+            else:
+                image_bytes = pix.tobytes("png")
+
+            page_hash = None
+            if self.llm.phash_threshold is not None:
+                page_hash = get_perceptual_hash(pix)
+
+        return image_bytes, page_hash
+
+    async def _convert_page(
+        self, page: fitz.Page, page_number: int, matrix: fitz.Matrix
+    ) -> str:
+        """Convert a single PDF page into an encoded image and extract markdown formatted text."""
+        try:
+            # Keep the event loop free for LLM requests while the page renders
+            image_bytes, page_hash = await asyncio.to_thread(
+                self._render_page, page, matrix
+            )
+            if image_bytes is None:
+                return ""
 
             return await self.llm.generate_markdown(
-                base64_encoded, pix, page_number, custom_prompt=custom_prompt
+                image_bytes, page_number, page_hash
             )
 
         except Exception as e:
             raise VisionParserError(
-                f"Failed to convert page {page_number + 1} to base64-encoded PNG: {str(e)}"
+                f"Failed to convert page {page_number + 1} to markdown content: {str(e)}"
             )
-        finally:
-            # Clean up pixmap to free memory
-            if pix is not None:
-                pix = None
 
-    async def _convert_pages_batch(self, pages: List[fitz.Page], start_idx: int):
-        """Process a batch of PDF pages concurrently."""
+    async def _convert_page_group(
+        self,
+        pdf_document: fitz.Document,
+        page_numbers: List[int],
+        matrices: Dict[int, fitz.Matrix],
+    ) -> List[str]:
+        """Convert consecutive PDF pages, sharing one LLM request when batching."""
+        if len(page_numbers) == 1:
+            page = pdf_document[page_numbers[0]]
+            return [
+                await self._convert_page(
+                    page, page_numbers[0], matrices[page.rotation]
+                )
+            ]
+
+        try:
+            converted_pages = dict.fromkeys(page_numbers, "")
+            images, content_pages = [], []
+            for page_number in page_numbers:
+                page = pdf_document[page_number]
+                image_bytes, _ = await asyncio.to_thread(
+                    self._render_page, page, matrices[page.rotation]
+                )
+                if image_bytes is None:
+                    continue
+                images.append(image_bytes)
+                content_pages.append(page_number)
+
+            if content_pages:
+                texts = await self.llm.generate_markdown_batch(images, content_pages)
+                converted_pages.update(zip(content_pages, texts))
+
+            return [converted_pages[page_number] for page_number in page_numbers]
+
+        except Exception as e:
+            raise VisionParserError(
+                f"Failed to convert pages {page_numbers[0] + 1}-{page_numbers[-1] + 1} "
+                f"to markdown content: {str(e)}"
+            )
+
+    async def _convert_pages(self, pdf_document: fitz.Document) -> List[str]:
+        """Convert all PDF pages on a single event loop, bounded by num_workers."""
+        total_pages = pdf_document.page_count
+        semaphore = asyncio.Semaphore(
+            self.num_workers if self.enable_concurrency else 1
+        )
+        # Pages usually share one rotation, so build each matrix once per document
+        matrices = {
+            rotation: self._calculate_matrix(rotation)
+            for rotation in {page.rotation for page in pdf_document}
+        }
+
+        async def _convert_bounded(
+            page_numbers: List[int],
+        ) -> Tuple[List[int], List[str]]:
+            async with semaphore:
+                texts = await self._convert_page_group(
+                    pdf_document, page_numbers, matrices
+                )
+                return page_numbers, texts
+
+        page_groups = [
+            list(range(start, min(start + self.batch_size, total_pages)))
+            for start in range(0, total_pages, self.batch_size)
+        ]
+
+        converted_pages = [""] * total_pages
+        tasks = [
+            asyncio.ensure_future(_convert_bounded(page_numbers))
+            for page_numbers in page_groups
+        ]
         try:
-            tasks = []
-            for i, page in enumerate(pages):
-                tasks.append(self._convert_page(page, start_idx + i))
-            return await asyncio.gather(*tasks)
+            for future in tqdm.as_completed(
+                tasks,
+                total=len(page_groups),
+                desc="Converting pages into markdown format",
+            ):
+                page_numbers, texts = await future
+                for page_number, text in zip(page_numbers, texts):
+                    converted_pages[page_number] = text
         finally:
-            await asyncio.sleep(0.5)
+            # Cancel pending pages on the first failure instead of spending quota
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return converted_pages
+
+    async def _convert_image(self, **image_source: Any) -> List[str]:
+        """Insert an image into a blank single-page document and convert that page."""
+        with fitz.open() as doc:
+            page = doc.new_page()
+            page.insert_image(page.rect, **image_source)
+            return [
+                await self._convert_page(
+                    page, 0, self._calculate_matrix(page.rotation)
+                )
+            ]
 
     def convert_file(self, file_path: Union[str, Path]) -> List[str]:
         """Convert the given file (PDF or image) to markdown text.
         
         Args:
             file_path: Path to PDF or image file
-            enable_concurrency: If True, processes PDF pages in parallel batches
-            num_workers: Number of concurrent workers for PDF processing
             
         Returns:
             List of markdown strings (one per page/image)
@@ -150,13 +279,13 @@ class VisionParser:
         Note:
             - Concurrency is only supported for PDF files
             - Image files are processed as single pages
-            - Batch size is determined by num_workers
+            - Pages share one event loop; at most num_workers are in flight
             
         Image Processing Steps:
             1. Validate file exists and is supported image format
             2. Create temporary PDF document with single page
             3. Insert image into page at full resolution
-            4. Convert page to base64-encoded PNG
+            4. Convert page to an encoded PNG image
             5. Process image through LLM pipeline
             6. Return markdown text as single-element list
             
@@ -164,8 +293,11 @@ class VisionParser:
             - PNG (.png)
             - JPEG (.jpg, .jpeg)
         """
+        return asyncio.run(self.aconvert_file(file_path))
+
+    async def aconvert_file(self, file_path: Union[str, Path]) -> List[str]:
+        """Async version of convert_file for callers already running an event loop."""
         file_path = Path(file_path)
-        converted_pages = []
 
         if not file_path.exists() or not file_path.is_file():
             raise FileNotFoundError(f"File not found: {file_path}")
@@ -176,51 +308,46 @@ class VisionParser:
         try:
             # Handle image files
             if file_path.suffix.lower() in [".png", ".jpg", ".jpeg"]:
-                # Create a single-page document from the image
-                doc = fitz.open()
-                page = doc.new_page()
-                rect = page.rect
-                page.insert_image(rect, filename=str(file_path))
-                
-                # Process the single page
-                text = asyncio.run(self._convert_page(page, 0))
-                return [text]
-            
+                return await self._convert_image(filename=str(file_path))
+
             # Handle PDF files
             with fitz.open(file_path) as pdf_document:
-                total_pages = pdf_document.page_count
-
-                with tqdm(
-                    total=total_pages,
-                    desc="Converting pages into markdown format",
-                ) as pbar:
-                    if self.enable_concurrency:
-                        # Process pages in batches based on num_workers
-                        for i in range(0, total_pages, self.num_workers):
-                            batch_size = min(self.num_workers, total_pages - i)
-                            # Extract only required pages for the batch
-                            batch_pages = [
-                                pdf_document[j] for j in range(i, i + batch_size)
-                            ]
-                            batch_results = asyncio.run(
-                                self._convert_pages_batch(batch_pages, i)
-                            )
-                            converted_pages.extend(batch_results)
-                            pbar.update(len(batch_results))
-                    else:
-                        for page_number in range(total_pages):
-                            # For non-concurrent processing, still need to run async code
-                            text = asyncio.run(
-                                self._convert_page(
-                                    pdf_document[page_number], page_number
-                                )
-                            )
-                            converted_pages.append(text)
-                            pbar.update(1)
-
-                return converted_pages
+                return await self._convert_pages(pdf_document)
 
         except Exception as e:
             raise VisionParserError(
                 f"Failed to convert PDF file into markdown content: {str(e)}"
             )
+
+    def convert_stream(self, data: bytes, filetype: str) -> List[str]:
+        """Convert in-memory file content (PDF or image) to markdown text.
+
+        Args:
+            data: Raw bytes of the PDF or image file
+            filetype: File extension such as "pdf", "png", "jpg" or "jpeg"
+
+        Returns:
+            List of markdown strings (one per page/image)
+        """
+        return asyncio.run(self.aconvert_stream(data, filetype))
+
+    async def aconvert_stream(self, data: bytes, filetype: str) -> List[str]:
+        """Async version of convert_stream for callers already running an event loop."""
+        filetype = filetype.lower().lstrip(".")
+
+        if filetype not in ["pdf", "png", "jpg", "jpeg"]:
+            raise UnsupportedFileError(f"Unsupported file type: {filetype}")
+
+        try:
+            # Handle image files
+            if filetype in ["png", "jpg", "jpeg"]:
+                return await self._convert_image(stream=data)
+
+            # Handle PDF files
+            with fitz.open(stream=data, filetype="pdf") as pdf_document:
+                return await self._convert_pages(pdf_document)
+
+        except Exception as e:
+            raise VisionParserError(
+                f"Failed to convert file stream into markdown content: {str(e)}"
+            )
@@ -66,7 +66,7 @@ class ImageData:
     @classmethod
     def extract_images(
         cls,
-        pix: fitz.Pixmap,
+        image_bytes: bytes,
         image_mode: Literal["url", "base64", None],
         page_number: int,
         min_dimensions: tuple = (100, 100),
@@ -75,11 +75,9 @@ class ImageData:
         with cls._lock:
             try:
                 min_width, min_height = min_dimensions
-                page_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
-                    pix.height, pix.width, pix.n
-                )
-                page_image = cv2.cvtColor(
-                    page_array, cv2.COLOR_RGBA2BGR if pix.n == 4 else cv2.COLOR_RGB2BGR
+                # Decode the encoded page image so the pixmap need not be kept alive
+                page_image = cv2.imdecode(
+                    np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR
                 )
                 processed_image = cls._prepare_image_for_detection(page_image)
 
@@ -143,6 +141,42 @@ class ImageData:
                 raise ImageExtractionError(f"Image processing failed: {str(e)}")
 
 
+def get_perceptual_hash(pix: fitz.Pixmap, hash_size: int = 8) -> int:
+    """Compute a DCT-based perceptual hash of a rendered page for near-duplicate lookup."""
+    page_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
+        pix.height, pix.width, pix.n
+    )
+    if pix.n == 1:
+        grayscale = page_array[:, :, 0]
+    else:
+        grayscale = cv2.cvtColor(
+            page_array, cv2.COLOR_RGBA2GRAY if pix.n == 4 else cv2.COLOR_RGB2GRAY
+        )
+
+    # Keep only the low-frequency DCT coefficients, which survive small changes
+    resized = cv2.resize(
+        grayscale, (hash_size * 4, hash_size * 4), interpolation=cv2.INTER_AREA
+    )
+    low_freq = cv2.dct(np.float32(resized))[:hash_size, :hash_size]
+    bits = (low_freq > np.median(low_freq)).flatten()
+
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+
+def get_pixel_variance(pix: fitz.Pixmap, shrink_factor: int = 16) -> float:
+    """Compute pixel variance on a downscaled copy of a page to detect blank pages."""
+    thumb = fitz.Pixmap(
+        pix,
+        max(1, pix.width // shrink_factor),
+        max(1, pix.height // shrink_factor),
+        None,
+    )
+    samples = np.frombuffer(thumb.samples, dtype=np.uint8).reshape(-1, thumb.n)
+
+    # Ignore the alpha channel so transparency does not count as content
+    return float(np.var(samples[:, : thumb.n - thumb.alpha]))
+
+
 def get_device_config() -> Tuple[Literal["cuda", "mps", "cpu"], int]:
     """Get optimal number of worker processes based on device."""
     import platform